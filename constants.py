@@ -0,0 +1,5 @@
+import sys
+
+# Used when an NPC has no 'greeting' field; shared by npc_chat and npc_creator.
+# Kept here so npc_creator doesn't have to import npc_chat until it launches it.
+DEFAULT_GREETING = sys.intern("Hello there! How can I help you today?")
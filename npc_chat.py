@@ -1,34 +1,89 @@
 import os
 import json
+import mmap
 import time
 import argparse
-import dotenv
+import difflib
+import hashlib
+import queue
+import shelve
+import threading
 from typing import Dict, List, Optional
 import sys
 
-# Try to import OpenAI if available
+from constants import DEFAULT_GREETING
+
+# Use orjson for the NPC file if available, falling back to the stdlib
 try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
+    import orjson
+    ORJSON_AVAILABLE = True
 except ImportError:
-    OPENAI_AVAILABLE = False
+    ORJSON_AVAILABLE = False
 
 # Constants
 NPC_DATA_FILE = "npc_data.json"
 OPENAI_MODEL = "gpt-4o"  # Using gpt-4o as the latest model
+SUMMARY_MODEL = "gpt-4o-mini"  # Cheaper model used to fold old turns into a summary
+HISTORY_HEAD_SIZE = 5  # Greeting plus the first two exchanges, kept verbatim
+HISTORY_TAIL_LIMIT = 20  # Rolling entries kept before the oldest get summarized
+HISTORY_TAIL_MAX = 2 * HISTORY_TAIL_LIMIT  # Hard cap if summarizing keeps failing
+RESPONSE_CACHE_FILE = ".npc_cache"  # shelve database of opening-turn replies
+RESPONSE_CACHE_SIZE = 500  # Oldest used entries are evicted past this count
+STREAM_FLUSH_SIZE = 64  # Buffered characters before streamed output is flushed
+
+def _end_chat() -> None:
+    """Handle 'quit'/'exit': end the chat session."""
+    print("Ending chat session.")
+
+def _change_npc() -> str:
+    """Handle 'change': let the caller pick the next NPC instead of recursing."""
+    return 'change'
+
+_EXIT_CMDS = frozenset({'quit', 'exit'})
+_CHANGE_CMDS = frozenset({'change'})
+# Command -> handler; add new chat commands here
+_COMMANDS = {
+    **{cmd: _end_chat for cmd in _EXIT_CMDS},
+    **{cmd: _change_npc for cmd in _CHANGE_CMDS},
+}
 
 class NPCChatSystem:
     def __init__(self):
         """Initialize the NPC chat system."""
         self.npcs = self._load_npcs()
+        # Ordered list for display, dict for direct lookup by ID
+        self._npc_index: Dict[str, Dict] = {
+            npc['id']: npc for npc in self.npcs if isinstance(npc, dict) and 'id' in npc
+        }
+        # Fallback for IDs typed with different case or stray whitespace
+        self._npc_index_ci: Dict[str, Dict] = {
+            npc_id.lower(): npc for npc_id, npc in self._npc_index.items()
+        }
         self.current_npc = None
         self.api_key = None
-        self.conversation_history = []
+        self.client = None
+        self._OpenAI = None
+        self.history_head = []
+        self.history_summary = None
+        self.history_tail = []
+        self._fold_backoff = 0
+        self._system_prompt_hash = None
+        self._system_message = None
         self.setup()
 
     def _load_npcs(self) -> List[Dict]:
         """Load NPC data from the JSON file."""
         try:
+            if ORJSON_AVAILABLE:
+                with open(NPC_DATA_FILE, 'rb') as file:
+                    # mmap can't map an empty file
+                    if os.fstat(file.fileno()).st_size == 0:
+                        return []
+                    # The file is only read here, so parse it straight from
+                    # the mapping instead of copying it into a bytes object
+                    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        with memoryview(mm) as view:
+                            return orjson.loads(view)
             with open(NPC_DATA_FILE, 'r') as file:
                 return json.load(file)
         except FileNotFoundError:
@@ -49,21 +104,34 @@ class NPCChatSystem:
                     "quest_instruction": "Might ask players to investigate strange occurrences in the forest."
                 }
             ]
-            with open(NPC_DATA_FILE, 'w') as file:
-                json.dump(sample_npcs, file, indent=4)
+            if ORJSON_AVAILABLE:
+                with open(NPC_DATA_FILE, 'wb') as file:
+                    file.write(orjson.dumps(sample_npcs, option=orjson.OPT_INDENT_2))
+            else:
+                with open(NPC_DATA_FILE, 'w') as file:
+                    json.dump(sample_npcs, file, indent=2)
             return sample_npcs
 
     def setup(self):
         """Set up the API provider and API key."""
-        # Load environment variables from root .env
-        dotenv.load_dotenv(dotenv.find_dotenv())
-        if not OPENAI_AVAILABLE:
+        # dotenv and openai are imported here rather than at module level so
+        # that importing this module (e.g. from npc_creator) stays cheap
+        import dotenv
+        try:
+            from openai import OpenAI
+        except ImportError:
             print("OpenAI package not installed. Please install it with: pip install openai")
             sys.exit(1)
+        self._OpenAI = OpenAI
+
+        # Load environment variables from root .env
+        dotenv.load_dotenv(dotenv.find_dotenv())
         self.api_key = os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             print("Error: OPENAI_API_KEY not found in .env. Please add it to your .env file.")
             sys.exit(1)
+        # One client for the whole session so its connection pool stays warm
+        self.client = self._OpenAI(api_key=self.api_key)
 
     def list_npcs(self):
         """Display all available NPCs."""
@@ -77,16 +145,109 @@ class NPCChatSystem:
             self.list_npcs()
             npc_id = input("\nEnter NPC ID to chat with: ")
         
-        for npc in self.npcs:
-            if npc['id'] == npc_id:
-                self.current_npc = npc
-                self.conversation_history = []
-                print(f"\nYou are now chatting with {npc['name']}.")
-                return True
+        npc = self._npc_index.get(npc_id) or self._npc_index_ci.get(npc_id.strip().lower())
+        if npc:
+            self.current_npc = npc
+            self._reset_history()
+            # Build the persona block once per NPC so the request prefix
+            # stays byte-identical across turns (server-side prompt caching).
+            # The hash is the starting point of the local response cache key.
+            system_prompt = self._create_system_prompt()
+            self._system_prompt_hash = hashlib.blake2b(
+                system_prompt.encode(), digest_size=16
+            ).digest()
+            self._system_message = {"role": "system", "content": system_prompt}
+            print(f"\nYou are now chatting with {npc['name']}.")
+            return True
         
         print(f"NPC with ID '{npc_id}' not found.")
+        close = difflib.get_close_matches(npc_id.strip().lower(), self._npc_index_ci.keys(), n=3)
+        suggestions = [self._npc_index_ci[key]['id'] for key in close]
+        if suggestions:
+            print(f"Did you mean: {', '.join(suggestions)}?")
         return False
 
+    def _reset_history(self):
+        """Clear the conversation history for a new chat session."""
+        self.history_head = []
+        self.history_summary = None
+        self.history_tail = []
+        self._fold_backoff = 0
+
+    def _append_history(self, entry: Dict):
+        """Append a message, filling the fixed head before the rolling tail."""
+        if len(self.history_head) < HISTORY_HEAD_SIZE:
+            self.history_head.append(entry)
+        else:
+            self.history_tail.append(entry)
+            if self._fold_backoff:
+                self._fold_backoff -= 1
+
+    def _history_messages(self) -> List[Dict]:
+        """Return the history in request order: head, summary, then tail."""
+        messages = list(self.history_head)
+        if self.history_summary:
+            messages.append(self.history_summary)
+        messages.extend(self.history_tail)
+        return messages
+
+    def _fold_history(self):
+        """Summarize the oldest tail entries once the tail grows too long.
+
+        The head is never touched, so the start of every request stays
+        identical and the provider's prompt cache keeps matching it.
+        """
+        if len(self.history_tail) <= HISTORY_TAIL_LIMIT:
+            return
+        if self._fold_backoff:
+            # A recent summary call failed; wait before trying again
+            self._cap_tail()
+            return
+
+        # Fold an even number of entries so the tail still starts on a user turn
+        folded = self.history_tail[:HISTORY_TAIL_LIMIT // 2]
+        transcript = "\n".join(f"{entry['role']}: {entry['content']}" for entry in folded)
+        if self.history_summary:
+            transcript = f"{self.history_summary['content']}\n{transcript}"
+
+        try:
+            response = self.client.chat.completions.create(
+                model=SUMMARY_MODEL,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": (
+                            "Summarize this conversation between a player and an RPG NPC "
+                            "in a few sentences. Keep names, promises and quest details."
+                        )
+                    },
+                    {"role": "user", "content": transcript}
+                ],
+                temperature=0.3,
+                max_tokens=200
+            )
+            summary = response.choices[0].message.content
+        except Exception:
+            # Keep the tail and retry only after a few more exchanges, so an
+            # unavailable summary model doesn't cost a failed call every turn
+            self._fold_backoff = HISTORY_TAIL_LIMIT // 2
+            self._cap_tail()
+            return
+
+        self.history_summary = {"role": "system", "content": f"[Earlier summary]: {summary}"}
+        self.history_tail = self.history_tail[len(folded):]
+
+    def _cap_tail(self):
+        """Drop the oldest tail pairs past HISTORY_TAIL_MAX.
+
+        Bounds the request while summarizing keeps failing. The head is left
+        alone so the cached prefix still matches.
+        """
+        excess = len(self.history_tail) - HISTORY_TAIL_MAX
+        if excess > 0:
+            excess += excess % 2
+            self.history_tail = self.history_tail[excess:]
+
     def _create_system_prompt(self) -> str:
         """Create a system prompt for the AI based on the current NPC."""
         npc = self.current_npc
@@ -99,105 +260,139 @@ class NPCChatSystem:
             f"Never break character or reference that you are an AI."
         )
 
-    def chat_with_huggingface(self, user_message: str) -> str:
-        """Generate a response using the Hugging Face Inference API."""
-        api_url = f"https://api-inference.huggingface.co/models/{HF_MODEL}"
-        headers = {"Authorization": f"Bearer {self.api_key}"}
-        
-        # Format the conversation history
-        system_prompt = self._create_system_prompt()
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        # Add conversation history
-        for entry in self.conversation_history:
-            messages.append(entry)
-        
-        # Add the current message
-        messages.append({"role": "user", "content": user_message})
-        
-        payload = {
-            "inputs": messages,
-            "parameters": {
-                "max_new_tokens": 250,
-                "temperature": 0.7,
-                "stream": True
-            }
-        }
-        
+    def _cache_key(self, user_message: str) -> Optional[str]:
+        """Return the response cache key for this turn, or None if uncacheable.
+
+        Only the opening turn is cached: the request is then fully determined
+        by the model, the NPC's prompt and its greeting, so all three go into
+        the key. Later replies depend on the rest of the conversation.
+        """
+        if self._history_messages() != self.history_head[:1]:
+            return None
+        prefix = hashlib.blake2b(self._system_prompt_hash, digest_size=16)
+        prefix.update(json.dumps([OPENAI_MODEL, *self.history_head]).encode())
+        prefix_hash = prefix.hexdigest()
+        normalized = " ".join(user_message.lower().split())
+        return f"{prefix_hash}:{self.current_npc['id']}:{normalized}"
+
+    def _cache_get(self, key: str) -> Optional[str]:
+        """Look up a cached response, refreshing its last-used time on a hit."""
         try:
-            print(f"\n{self.current_npc['name']}: ", end="", flush=True)
-            response = requests.post(api_url, headers=headers, json=payload, stream=True)
-            
-            if response.status_code != 200:
-                error_msg = f"Error: API call failed with status {response.status_code}"
-                try:
-                    error_data = response.json()
-                    if 'error' in error_data:
-                        error_msg += f" - {error_data['error']}"
-                except:
-                    pass
-                print(error_msg)
-                return "I'm sorry, I'm having trouble responding right now."
-            
-            full_response = ""
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        chunk_data = json.loads(line.decode('utf-8'))
-                        if 'generated_text' in chunk_data:
-                            chunk = chunk_data['generated_text']
-                            print(chunk, end="", flush=True)
-                            full_response += chunk
-                    except json.JSONDecodeError:
-                        pass
-            
-            return full_response
-        
-        except Exception as e:
-            print(f"\nError: {str(e)}")
-            return "I'm sorry, I'm having trouble responding right now."
+            with shelve.open(RESPONSE_CACHE_FILE) as cache:
+                entry = cache.get(key)
+                if entry is None:
+                    return None
+                cache[key] = (time.time(), entry[1])
+                return entry[1]
+        except Exception:
+            # A missing or unreadable cache just means a normal API call
+            return None
 
-    def chat_with_openai(self, user_message: str) -> str:
-        """Generate a response using the OpenAI API."""
+    def _cache_put(self, key: str, response: str):
+        """Store a response, evicting the least recently used past the limit."""
         try:
-            client = OpenAI(api_key=self.api_key)
-            
-            # Format the conversation history
-            system_prompt = self._create_system_prompt()
-            messages = [{"role": "system", "content": system_prompt}]
-            
-            # Add conversation history
-            for entry in self.conversation_history:
-                messages.append(entry)
-            
-            # Add the current message
-            messages.append({"role": "user", "content": user_message})
+            with shelve.open(RESPONSE_CACHE_FILE) as cache:
+                cache[key] = (time.time(), response)
+                if len(cache) > RESPONSE_CACHE_SIZE:
+                    by_age = sorted(cache.keys(), key=lambda k: cache[k][0])
+                    for old_key in by_age[:len(cache) - RESPONSE_CACHE_SIZE]:
+                        del cache[old_key]
+        except Exception:
+            pass
+
+    def _print_stream(self, stream) -> str:
+        """Print a streamed completion as it arrives and return the full text."""
+        # Receive the stream on a background thread so printing never
+        # holds up reading the next network chunk
+        tokens = queue.Queue()
+
+        def produce():
+            try:
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        tokens.put(chunk.choices[0].delta.content)
+            except Exception as e:
+                tokens.put(e)
+            finally:
+                tokens.put(None)
+
+        threading.Thread(target=produce, daemon=True).start()
+
+        # Write tokens in batches rather than flushing stdout per token
+        full_response = ""
+        buf = []
+        buflen = 0
+        try:
+            while (content := tokens.get()) is not None:
+                if isinstance(content, Exception):
+                    raise content
+                buf.append(content)
+                buflen += len(content)
+                if buflen >= STREAM_FLUSH_SIZE or '\n' in content:
+                    sys.stdout.write(''.join(buf))
+                    sys.stdout.flush()
+                    buf.clear()
+                    buflen = 0
+                full_response += content
+        finally:
+            # Show any text already received, even if the stream failed
+            if buf:
+                sys.stdout.write(''.join(buf))
+                sys.stdout.flush()
+        return full_response
+
+    def chat_with_openai(self, user_message: str) -> Optional[str]:
+        """Generate a response using the OpenAI API.
+
+        Returns None if the request failed, so the turn isn't kept in history.
+        """
+        cache_key = self._cache_key(user_message)
+        if cache_key:
+            cached = self._cache_get(cache_key)
+            if cached:
+                print(f"\n{self.current_npc['name']}: {cached}", end="", flush=True)
+                return cached
+
+        try:
+            # Static persona first, then the append-only history, then the new turn
+            messages = [
+                self._system_message,
+                *self._history_messages(),
+                {"role": "user", "content": user_message}
+            ]
             
-            # Stream the response
+            # Only stream when a terminal is showing the reply as it arrives;
+            # piped or redirected output gets the whole reply in one response
+            use_stream = sys.stdout.isatty()
             print(f"\n{self.current_npc['name']}: ", end="", flush=True)
-            stream = client.chat.completions.create(
+            response = self.client.chat.completions.create(
                 model=OPENAI_MODEL,
                 messages=messages,
                 temperature=0.7,
                 max_tokens=250,
-                stream=True
+                stream=use_stream
             )
             
-            full_response = ""
-            for chunk in stream:
-                if chunk.choices and chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    print(content, end="", flush=True)
-                    full_response += content
+            if use_stream:
+                full_response = self._print_stream(response)
+            else:
+                full_response = response.choices[0].message.content or ""
+                print(full_response, end="", flush=True)
             
+            if cache_key and full_response:
+                self._cache_put(cache_key, full_response)
             return full_response
             
         except Exception as e:
             print(f"\nError: {str(e)}")
-            return "I'm sorry, I'm having trouble responding right now."
+            print("I'm sorry, I'm having trouble responding right now.")
+            return None
+
+    def chat(self) -> Optional[str]:
+        """Main chat loop with the selected NPC.
 
-    def chat(self):
-        """Main chat loop with the selected NPC."""
+        Returns 'change' if the user asked to switch NPCs, otherwise None.
+        """
         if not self.current_npc:
             print("No NPC selected. Please select an NPC first.")
             return
@@ -207,56 +402,50 @@ class NPCChatSystem:
         print("Type 'quit' to end the chat, or 'change' to select a different NPC.")
         
         # Initial greeting from NPC (customizable per-NPC via JSON 'greeting' field)
-        greeting = self.current_npc.get(
-            'greeting',
-            "Hello there! How can I help you today?"
-        )
+        greeting = self.current_npc.get('greeting', DEFAULT_GREETING)
         print(f"\n{self.current_npc['name']}: {greeting}")
-        self.conversation_history.append({"role": "assistant", "content": greeting})
+        self._append_history({"role": "assistant", "content": greeting})
         
         while True:
             user_input = input("\nYou: ")
             
-            # Exit commands
-            cmd = user_input.strip().lower()
-            if cmd in ('quit', 'exit'):
-                print("Ending chat session.")
-                break
-            elif cmd == 'change':
-                self.list_npcs()
-                npc_id = input("\nEnter NPC ID to chat with: ")
-                if self.select_npc(npc_id):
-                    self.chat()  # Start a new chat with the selected NPC
-                break
-            
-            # Add user message to history
-            self.conversation_history.append({"role": "user", "content": user_input})
+            # Chat commands end this session; their result goes to the caller
+            handler = _COMMANDS.get(user_input.strip().lower())
+            if handler:
+                return handler()
             
             # Generate response
             response = self.chat_with_openai(user_input)
+            if response is None:
+                # Leave failed turns out of history; the head would pin them
+                # into every later request
+                continue
             
-            # Add assistant response to history
-            self.conversation_history.append({"role": "assistant", "content": response})
-            
-            # Limit conversation history to last 10 exchanges to avoid token limits
-            if len(self.conversation_history) > 20:
-                self.conversation_history = self.conversation_history[-20:]
+            # Append the exchange to history, folding old turns into the summary
+            self._append_history({"role": "user", "content": user_input})
+            self._append_history({"role": "assistant", "content": response})
+            self._fold_history()
 
-def main():
+def main(argv: Optional[List[str]] = None):
+    """Run the chat system. argv defaults to sys.argv[1:] when None."""
     parser = argparse.ArgumentParser(description="NPC Chat System")
     parser.add_argument("--npc", help="NPC ID to start chatting with")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     npc_system = NPCChatSystem()
     
     if args.npc:
-        if npc_system.select_npc(args.npc):
-            npc_system.chat()
+        selected = npc_system.select_npc(args.npc)
     else:
         npc_system.list_npcs()
         npc_id = input("\nEnter NPC ID to chat with: ")
-        if npc_system.select_npc(npc_id):
-            npc_system.chat()
+        selected = npc_system.select_npc(npc_id)
+    
+    # Keep chatting until the user quits or picks an unknown NPC
+    while selected and npc_system.chat() == 'change':
+        npc_system.list_npcs()
+        npc_id = input("\nEnter NPC ID to chat with: ")
+        selected = npc_system.select_npc(npc_id)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -3,28 +3,60 @@ import os
 import sys
 import json
 
+from constants import DEFAULT_GREETING
+
+# Use orjson for the NPC file if available, falling back to the stdlib
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 NPC_DATA_FILE = "npc_data.json"
 
 def load_npcs():
     try:
+        if ORJSON_AVAILABLE:
+            with open(NPC_DATA_FILE, 'rb') as f:
+                return orjson.loads(f.read())
         with open(NPC_DATA_FILE, 'r') as f:
             return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
+    except (FileNotFoundError, json.JSONDecodeError):  # also covers orjson.JSONDecodeError
         return []
 
 def save_npcs(npcs):
-    with open(NPC_DATA_FILE, 'w') as f:
-        json.dump(npcs, f, indent=4)
+    if ORJSON_AVAILABLE:
+        payload = orjson.dumps(npcs, option=orjson.OPT_INDENT_2)
+    else:
+        payload = json.dumps(npcs, indent=2).encode('utf-8')
+
+    # Skip the write if the file already holds exactly this content
+    try:
+        with open(NPC_DATA_FILE, 'rb') as f:
+            if f.read() == payload:
+                print(f"No changes to {NPC_DATA_FILE}.")
+                return
+    except FileNotFoundError:
+        pass
+
+    # Write to a temp file and rename it over the original so a crash
+    # mid-write can't leave a truncated NPC file behind
+    tmp = NPC_DATA_FILE + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, NPC_DATA_FILE)
     print(f"Saved {len(npcs)} NPC(s) to {NPC_DATA_FILE}.")
 
-def create_npc(existing_ids):
+def create_npc(npc_index):
     while True:
         npc_id = input("Enter NPC ID (or 'done' to finish): ").strip()
         if not npc_id:
             continue
         if npc_id.lower() == 'done':
             return None
-        if npc_id in existing_ids:
+        if npc_id in npc_index:
             print(f"ID '{npc_id}' already exists. Choose another.")
             continue
         break
@@ -32,8 +64,7 @@ def create_npc(existing_ids):
     personality = input("Enter personality description: ").strip()
     role = input("Enter role description: ").strip()
     quest_instruction = input("Enter quest instruction: ").strip()
-    default_greet = "Hello there! How can I help you today?"
-    greeting = input(f"Enter starting greeting (optional) [default: {default_greet}]: ").strip()
+    greeting = input(f"Enter starting greeting (optional) [default: {DEFAULT_GREETING}]: ").strip()
 
     npc = {
         "id": npc_id,
@@ -49,14 +80,14 @@ def create_npc(existing_ids):
 def main():
     print("=== NPC Creator ===")
     npcs = load_npcs()
-    existing_ids = {npc.get('id') for npc in npcs if isinstance(npc, dict) and 'id' in npc}
+    npc_index = {npc['id']: npc for npc in npcs if isinstance(npc, dict) and 'id' in npc}
 
     while True:
-        new_npc = create_npc(existing_ids)
+        new_npc = create_npc(npc_index)
         if new_npc is None:
             break
         npcs.append(new_npc)
-        existing_ids.add(new_npc['id'])
+        npc_index[new_npc['id']] = new_npc
         print(f"Added NPC '{new_npc['id']}'.")
 
     save_npcs(npcs)
@@ -64,7 +95,8 @@ def main():
     # >>> FIXED: directly import and call chat.main() <<<
     print("\nLaunching NPC Chat…")
     import npc_chat
-    npc_chat.main()
+    # Pass an empty list so npc_chat doesn't parse argv meant for npc_creator
+    npc_chat.main([])
 
 if __name__ == '__main__':
     main()